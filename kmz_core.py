@@ -0,0 +1,548 @@
+# Shared photo -> KMZ pipeline behind create.py (macOS) and create-win.py (Windows / Linux).
+import collections, errno, functools, io, json, mmap, os, shutil, subprocess, sys, tempfile, threading, time, zipfile, zlib, csv
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from operator import itemgetter
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+try:
+    import pillow_heif
+    from PIL import Image
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+FICLONE = 0x40049409
+class _LibdeflateCompressor:
+    def __init__(self, level):
+        self.level = level
+        self.chunks = []
+    def compress(self, data):
+        self.chunks.append(bytes(data))
+        return b""
+    def flush(self):
+        return deflate.deflate_compress(b"".join(self.chunks), self.level)
+class _ParallelDeflate:
+    # pigz-style: deflate 1 MiB blocks on worker threads, each primed with the previous block's
+    # last 32 KiB and ended with a sync flush, so the concatenation is one raw deflate stream.
+    BLOCK = 1 << 20
+    def __init__(self, z, level):
+        self.z = z
+        self.level = level
+        self.buf = bytearray()
+        self.prev = b""
+        self.pending = collections.deque()
+        self.workers = os.cpu_count() or 4
+        self.ex = ThreadPoolExecutor(max_workers=self.workers)
+    def _deflate(self, block, zdict, final):
+        z = self.z
+        c = z.compressobj(self.level, z.DEFLATED, -15, zdict=zdict) if zdict else z.compressobj(self.level, z.DEFLATED, -15)
+        return c.compress(block) + c.flush(z.Z_FINISH if final else z.Z_SYNC_FLUSH)
+    def _submit(self, block, final):
+        self.pending.append(self.ex.submit(self._deflate, block, self.prev, final))
+        self.prev = block[-32768:]
+    def compress(self, data):
+        self.buf += data
+        while len(self.buf) >= self.BLOCK:
+            self._submit(bytes(self.buf[:self.BLOCK]), False)
+            del self.buf[:self.BLOCK]
+        out = []
+        while self.pending and (self.pending[0].done() or len(self.pending) > 2 * self.workers):
+            out.append(self.pending.popleft().result())
+        return b"".join(out)
+    def flush(self):
+        self._submit(bytes(self.buf), True)
+        self.buf.clear()
+        try:
+            return b"".join(f.result() for f in self.pending)
+        finally:
+            self.pending.clear()
+            self.ex.shutdown()
+_zip_get_compressor = zipfile._get_compressor
+def _get_compressor(compress_type, compresslevel=None):
+    if compress_type == zipfile.ZIP_DEFLATED:
+        if deflate is not None:
+            return _LibdeflateCompressor(6 if compresslevel is None else compresslevel)
+        z, level = zlib_ng or zlib, -1 if compresslevel is None else compresslevel
+        if (os.cpu_count() or 1) > 1:
+            return _ParallelDeflate(z, level)
+        return z.compressobj(level, z.DEFLATED, -15)
+    return _zip_get_compressor(compress_type, compresslevel)
+zipfile._get_compressor = _get_compressor
+if deflate is not None or zlib_ng is not None:
+    zipfile.crc32 = deflate.crc32 if deflate is not None else zlib_ng.crc32
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS}
+_no_link, _no_clone = set(), set()
+shutil.COPY_BUFSIZE = max(shutil.COPY_BUFSIZE, 4 << 20)
+def _fast_copy(src, dst, link=False):
+    # link=True only for files the tool owns (converted JPEGs); originals are reflinked or copied.
+    # Never write into an existing dst: it may be hard-linked to another file.
+    try:
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    pair = (os.path.dirname(src), os.path.dirname(dst))
+    if link and pair not in _no_link:
+        for retry in (True, False):
+            try:
+                os.link(src, dst)
+                return
+            except FileExistsError:
+                if not retry:
+                    break
+                try:
+                    os.remove(dst)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                if e.errno in _UNSUPPORTED:
+                    _no_link.add(pair)
+                break
+    fd, tmp = tempfile.mkstemp(prefix=".", suffix=".part", dir=os.path.dirname(dst) or ".")
+    try:
+        cloned = False
+        with os.fdopen(fd, "wb") as fd:
+            if fcntl is not None and sys.platform.startswith("linux") and pair not in _no_clone:
+                try:
+                    with open(src, "rb") as fs:
+                        fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+                    cloned = True
+                except OSError as e:
+                    if e.errno in _UNSUPPORTED:
+                        _no_clone.add(pair)
+        if cloned:
+            shutil.copystat(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+class ExifToolDaemon:
+    def __init__(self):
+        self.proc = None
+        self.n = 0
+        self.lock = threading.Lock()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+    def execute(self, *args):
+        with self.lock:
+            return self._execute(args)
+    def _execute(self, args):
+        if self.proc is None:
+            self.proc = subprocess.Popen(["exiftool", "-stay_open", "True", "-@", "-"],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+        self.n += 1
+        try:
+            self.proc.stdin.write("\n".join(args) + f"\n-execute{self.n}\n")
+            self.proc.stdin.flush()
+        except OSError:
+            raise RuntimeError("exiftool exited unexpectedly")
+        ready = f"{{ready{self.n}}}"
+        out = []
+        for line in self.proc.stdout:
+            if line.rstrip() == ready:
+                return "".join(out)
+            out.append(line)
+        raise RuntimeError("exiftool exited unexpectedly")
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write("-stay_open\nFalse\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+        except Exception:
+            self.proc.kill()
+        self.proc = None
+def _pillow_to_jpeg(src, out_jpg):
+    try:
+        with Image.open(src) as img:
+            img.convert("RGB").save(out_jpg, "JPEG", quality=90, exif=img.info.get("exif") or b"",
+                                    icc_profile=img.info.get("icc_profile"))
+        return True
+    except Exception:
+        return False
+def convert_heic_to_jpeg(src, workdir, et, converter="magick"):
+    base = os.path.basename(src)
+    out_jpg = os.path.join(workdir, os.path.splitext(base)[0] + ".jpg")
+    if pillow_heif is not None and _pillow_to_jpeg(src, out_jpg):
+        pass
+    elif converter == "sips":
+        r = subprocess.run(["sips", "-s", "format", "jpeg", src, "--out", out_jpg], capture_output=True, text=True)
+        if r.returncode != 0 or not os.path.exists(out_jpg):
+            raise RuntimeError(r.stderr.strip() or "sips failed")
+    else:
+        try:
+            r = subprocess.run(["magick", src, out_jpg], capture_output=True, text=True)
+            if r.returncode != 0:
+                raise RuntimeError(r.stderr or "magick failed")
+        except Exception:
+            r2 = subprocess.run(["ffmpeg", "-y", "-i", src, out_jpg], capture_output=True, text=True)
+            if r2.returncode != 0:
+                raise RuntimeError("HEIC -> JPEG conversion failed. Install ImageMagick (magick) or ffmpeg.")
+    et.execute("-charset", "filename=utf8", "-overwrite_original", "-tagsFromFile", src, out_jpg)
+    return out_jpg
+def _copy_job(src, dst, strict, link=False):
+    try:
+        _fast_copy(src, dst, link)
+    except Exception:
+        if strict:
+            raise
+def _convert_one(src, workdir, et, converter):
+    try:
+        return convert_heic_to_jpeg(src, workdir, et, converter)
+    except Exception as e:
+        return e
+def _sips_batch(srcs, workdir, et):
+    try:
+        r = subprocess.run(["sips", "-s", "format", "jpeg", *srcs, "--out", workdir], capture_output=True, text=True)
+    except OSError as e:
+        return {src: e for src in srcs}
+    out = {}
+    for src in srcs:
+        base = os.path.basename(src)
+        out_jpg = os.path.join(workdir, os.path.splitext(base)[0] + ".jpg")
+        if not os.path.exists(out_jpg) and os.path.exists(os.path.join(workdir, base)):
+            os.replace(os.path.join(workdir, base), out_jpg)
+        if not os.path.exists(out_jpg):
+            out[src] = RuntimeError(r.stderr.strip() or "sips failed")
+            continue
+        try:
+            et.execute("-charset", "filename=utf8", "-overwrite_original", "-tagsFromFile", src, out_jpg)
+            out[src] = out_jpg
+        except Exception as e:
+            out[src] = e
+    return out
+def _convert_batch(srcs, workdir, et, converter):
+    # Sources from different folders can share a stem; the n-th repeat converts into workdir/<n>.
+    seen = collections.Counter()
+    dirs = []
+    for src in srcs:
+        stem = os.path.splitext(os.path.basename(src))[0].lower()
+        dirs.append(os.path.join(workdir, str(seen[stem])))
+        seen[stem] += 1
+    for d in set(dirs):
+        os.makedirs(d, exist_ok=True)
+    if converter == "sips" and pillow_heif is None:
+        out = {}
+        for d in dict.fromkeys(dirs):
+            out.update(_sips_batch([src for src, sd in zip(srcs, dirs) if sd == d], d, et))
+        return out
+    return {src: _convert_one(src, d, et, converter) for src, d in zip(srcs, dirs)}
+def submit_heic_conversions(ex, srcs, workdir, et, converter, workers):
+    size = max(1, min(200, -(-len(srcs) // workers)))
+    return [ex.submit(_convert_batch, srcs[i:i + size], os.path.join(workdir, str(i)), et, converter)
+            for i in range(0, len(srcs), size)]
+def _dir_key(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino
+def scan_dir(image_dir, allowed_exts):
+    images, others = {}, []
+    stack = [image_dir]
+    visited = {_dir_key(image_dir)}
+    while stack:
+        subdirs = []
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                listing = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print("Warning: cannot read folder", d, "->", e)
+            continue
+        for e in listing:
+            if e.name.startswith("."):
+                continue
+            if e.is_dir():
+                # Linked folders are followed like exiftool -r did; the (dev, inode) set stops loops.
+                try:
+                    key = _dir_key(e.path)
+                except OSError as err:
+                    print("Warning: cannot read folder", e.path, "->", err)
+                    continue
+                if key in visited:
+                    print("Warning: skipping already scanned folder", e.path)
+                    continue
+                visited.add(key)
+                subdirs.append(e.path)
+            elif e.is_file():
+                if os.path.splitext(e.name)[1].lower() in allowed_exts:
+                    images[e.path] = e
+                else:
+                    others.append(e.path)
+        stack.extend(reversed(subdirs))
+    return images, others
+EXIFTOOL_JSON_ARGS = ("-json", "-n", "-charset", "filename=utf8", "-FileName", "-SourceFile",
+                      "-GPSLatitude", "-GPSLongitude", "-GPSAltitude", "-DateTimeOriginal")
+SMALL_BATCH = 50
+def exiftool_json_daemon(et, paths):
+    if not paths:
+        return []
+    out = et.execute(*EXIFTOOL_JSON_ARGS, *paths)
+    if not out.strip():
+        raise RuntimeError("exiftool failed: no metadata returned")
+    try:
+        return json_loads(out)
+    except ValueError as e:
+        raise RuntimeError(f"could not parse exiftool output: {e}")
+def _iter_json_objects(text):
+    dec = json.JSONDecoder()
+    i, n = 0, len(text)
+    while True:
+        while i < n and text[i] in " \t\r\n[,]":
+            i += 1
+        if i >= n:
+            return
+        obj, i = dec.raw_decode(text, i)
+        if isinstance(obj, list):
+            yield from obj
+        else:
+            yield obj
+def iter_exiftool_json(paths, argfile):
+    if not paths:
+        return
+    with open(argfile, "w", encoding="utf-8") as f:
+        f.write("\n".join(paths) + "\n")
+    cmd = ["exiftool", *EXIFTOOL_JSON_ARGS, "-@", argfile]
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, text=True, encoding="utf-8")
+        buf = []
+        for line in proc.stdout:
+            if not buf:
+                line = line.lstrip("[")
+            if line.rstrip() in ("}", "},", "}]"):
+                buf.append("}")
+                yield json_loads("".join(buf))
+                buf = []
+            else:
+                buf.append(line)
+        if proc.wait() != 0:
+            err.seek(0)
+            raise RuntimeError(err.read().decode(errors="replace").strip() or "exiftool failed")
+    # Output not laid out one record per "}" line: decode whatever the framing left over.
+    try:
+        yield from _iter_json_objects("".join(buf))
+    except ValueError as e:
+        raise RuntimeError(f"could not parse exiftool output: {e}")
+def _map_entry(src, arcname):
+    zi = zipfile.ZipInfo.from_file(src, arcname)
+    if not zi.file_size:
+        return zi, b""
+    with open(src, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        mm.madvise(mmap.MADV_WILLNEED)
+    return zi, mm
+def _prefetch(fn, args, depth):
+    with ThreadPoolExecutor(max_workers=depth) as ex:
+        pending = collections.deque()
+        for a in args:
+            pending.append(ex.submit(fn, *a))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+def _num(v):
+    if v is None or type(v) is float:
+        return v
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+_DT_FORMATS = ["%Y:%m:%d %H:%M:%S", "%Y:%m:%d"]
+def _mtime_dt(src):
+    try:
+        return datetime.utcfromtimestamp((src.stat() if isinstance(src, os.DirEntry) else os.stat(src)).st_mtime)
+    except Exception:
+        return None
+@functools.lru_cache(maxsize=4096)
+def _parse_exif_dt(dt_str):
+    try:
+        if len(dt_str) == 19 and dt_str[4] == ":" and dt_str[7] == ":" and dt_str[10] == " ":
+            digits = dt_str[0:4] + dt_str[5:7] + dt_str[8:10] + dt_str[11:13] + dt_str[14:16] + dt_str[17:19]
+            if digits.isascii() and digits.isdigit():
+                return datetime(int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+                                int(digits[8:10]), int(digits[10:12]), int(digits[12:14]))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(dt_str)
+    except Exception:
+        pass
+    for fmt in _DT_FORMATS:
+        try:
+            dt = datetime.strptime(dt_str, fmt)
+        except Exception:
+            continue
+        if fmt is not _DT_FORMATS[0]:
+            _DT_FORMATS.remove(fmt)
+            _DT_FORMATS.insert(0, fmt)
+        return dt
+    return None
+def parse_dt(dt_str, src):
+    if not dt_str:
+        return _mtime_dt(src)
+    return _parse_exif_dt(dt_str)
+ICON_URL = "http://maps.google.com/mapfiles/kml/shapes/donut.png"
+_XML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+KML_HEADER = (f'<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+              f'<name>{{name}}</name><open>1</open><Style id="customIcon"><IconStyle>'
+              f'<Icon><href>{ICON_URL}</href></Icon><scale>1.2</scale></IconStyle></Style>\n')
+PLACEMARK_TMPL = ('<Placemark><name>{n}</name><styleUrl>#customIcon</styleUrl>'
+                  '<description><![CDATA[<img src="{i}" width="400"/>]]></description>'
+                  '<Point><coordinates>{c}</coordinates></Point></Placemark>\n')
+KML_FOOTER = "</Document></kml>\n"
+def make_kml(placemarks, doc_name, out):
+    write, fmt = out.write, PLACEMARK_TMPL.format
+    write(KML_HEADER.format(name=doc_name.translate(_XML_ESCAPE_TABLE)))
+    for p in placemarks:
+        alt = p['alt']
+        write(fmt(n=p['kname'], i=p['kimg'],
+                  c=f"{p['lon']},{p['lat']}" if alt is None else f"{p['lon']},{p['lat']},{alt}"))
+    write(KML_FOOTER)
+@dataclass
+class KmzConfig:
+    image_dir: str
+    out_kmz: str = "images.kmz"
+    converter: str = "magick"
+    heic_exts: tuple = (".heic", ".heif")
+    @property
+    def allowed_exts(self):
+        return {".jpg", ".jpeg", ".png", *self.heic_exts}
+    @classmethod
+    def from_argv(cls, argv, **kw):
+        if len(argv) < 2:
+            print(f"Usage: python3 {os.path.basename(argv[0])} IMAGEDIR [OUTPUT.kmz]")
+            sys.exit(1)
+        image_dir = argv[1]
+        out_kmz = argv[2] if len(argv) > 2 and not argv[2].startswith("--") else "images.kmz"
+        if not os.path.isdir(image_dir):
+            print("Error: directory not found:", image_dir)
+            sys.exit(1)
+        return cls(image_dir, out_kmz, **kw)
+def build_kmz(cfg):
+    allowed_exts = cfg.allowed_exts
+    out_dir = os.path.dirname(cfg.out_kmz) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    convert_dir = tempfile.mkdtemp(prefix=".heicfix_", dir=out_dir)
+    et = ExifToolDaemon()
+    try:
+        items = []
+        nongeo = []
+        dirents, nonfiles = scan_dir(cfg.image_dir, allowed_exts)
+        paths = list(dirents)
+        entries = []
+        workers = os.cpu_count() or 4
+        heics = [p for p in paths if os.path.splitext(p)[1].lower() in cfg.heic_exts]
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            batches = submit_heic_conversions(ex, heics, convert_dir, et, cfg.converter, workers)
+            image_dir, exists, join, basename = cfg.image_dir, os.path.exists, os.path.join, os.path.basename
+            if len(paths) < SMALL_BATCH:
+                records = exiftool_json_daemon(et, paths)
+            else:
+                records = iter_exiftool_json(paths, os.path.join(convert_dir, "files.txt"))
+            for item in records:
+                get = item.get
+                src = get("SourceFile") or get("FileName")
+                if not src:
+                    continue
+                if src not in dirents and not exists(src):
+                    src = join(image_dir, basename(src))
+                entries.append((src, get("GPSLatitude"), get("GPSLongitude"), get("GPSAltitude"), get("DateTimeOriginal")))
+            converted = {}
+            for f in batches:
+                converted.update((os.path.normpath(k), v) for k, v in f.result().items())
+        normpath, dt_max = os.path.normpath, datetime.max
+        for candidate, lat, lon, alt, dt_str in entries:
+            norm = converted.get(normpath(candidate), candidate) if converted else candidate
+            if isinstance(norm, Exception):
+                print("Warning: conversion failed for", candidate, "->", norm)
+                nonfiles.append(candidate)
+                continue
+            lat = _num(lat); lon = _num(lon)
+            dt = parse_dt(dt_str, dirents.get(candidate, candidate))
+            base = basename(norm)
+            if lat is None or lon is None:
+                nongeo.append({"src": norm, "base": base, "dt": dt})
+                continue
+            items.append({"src": norm, "base": base, "kimg": "files/" + base, "lon": lon, "lat": lat, "alt": _num(alt), "dt": dt, "key": dt or dt_max})
+        items.sort(key=itemgetter("key"))
+        for i, p in enumerate(items, start=1):
+            p['kname'] = f"p{i}"
+        files_geo_dir = os.path.join(out_dir, "files_geo")
+        files_nongeo_dir = os.path.join(out_dir, "files_nongeo")
+        files_nonimg_dir = os.path.join(out_dir, "files_nonimg")
+        os.makedirs(files_geo_dir, exist_ok=True)
+        os.makedirs(files_nongeo_dir, exist_ok=True)
+        os.makedirs(files_nonimg_dir, exist_ok=True)
+        owned = {v for v in converted.values() if not isinstance(v, Exception)}
+        rows = []
+        copies = []
+        sl = 1
+        for p in items:
+            copies.append((p['src'], os.path.join(files_geo_dir, p['base']), True, p['src'] in owned))
+            rows.append((sl, p['base'], p['dt'].isoformat() if p['dt'] else "", p['lat'], p['lon'], "OK"))
+            sl += 1
+        for ng in nongeo:
+            copies.append((ng['src'], os.path.join(files_nongeo_dir, ng['base']), False, ng['src'] in owned))
+            rows.append((sl, ng['base'], ng['dt'].isoformat() if ng['dt'] else "", "", "", "NO_GPS"))
+            sl += 1
+        for nf in nonfiles:
+            base = os.path.basename(nf)
+            copies.append((nf, os.path.join(files_nonimg_dir, base), False))
+            rows.append((sl, base, "", "", "", "NON_IMAGE"))
+            sl += 1
+        out_name = os.path.splitext(os.path.basename(cfg.out_kmz))[0]
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as cp:
+            copying = [cp.submit(_copy_job, *c) for c in {c[1]: c for c in copies}.values()]
+            with zipfile.ZipFile(cfg.out_kmz, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as kmz:
+                kml_info = zipfile.ZipInfo("doc.kml", time.localtime()[:6])
+                kml_info.compress_type = zipfile.ZIP_DEFLATED
+                kml_info._compresslevel = kmz.compresslevel
+                with io.TextIOWrapper(kmz.open(kml_info, "w"), encoding="utf-8") as f:
+                    make_kml(reversed(items), out_name, f)
+                archived = {p['kimg']: p['src'] for p in items}
+                for zi, data in _prefetch(_map_entry, ((src, arc) for arc, src in archived.items()), os.cpu_count() or 4):
+                    kmz.writestr(zi, data)
+                    if isinstance(data, mmap.mmap):
+                        data.close()
+            for f in copying:
+                f.result()
+        csv_path = os.path.join(out_dir, out_name + "_report.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8", buffering=1 << 20) as cf:
+            w = csv.writer(cf)
+            w.writerow(("slno", "filename", "datetime", "lat", "long", "status"))
+            w.writerows(rows)
+        print("KMZ created:", cfg.out_kmz)
+        print("CSV report:", csv_path)
+        print("Files with geo (copied):", files_geo_dir)
+        print("Files without geo (copied):", files_nongeo_dir)
+        print("Non-image files (copied):", files_nonimg_dir)
+    finally:
+        et.close()
+        try:
+            shutil.rmtree(convert_dir)
+        except Exception:
+            pass